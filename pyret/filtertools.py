@@ -7,17 +7,26 @@ spatiotemporal filters, and basic filter signal processing.
 
 import numpy as np
 import scipy
+from scipy.linalg.blas import dsyr, ssyr, dsyrk, ssyrk
 from skimage.measure import label, regionprops
-from functools import reduce
 
 from pyret.stimulustools import slicestim
-from pyret.utils import flat2d
+from pyret.utils import flat2d, _sampling_period
 
 __all__ = ['ste', 'sta', 'stc', 'lowranksta', 'decompose',
            'filterpeak', 'smooth', 'cutout', 'resample', 'flat2d',
            'get_ellipse', 'get_regionprops', 'normalize_spatial',
            'linear_response', 'revcorr']
 
+# Approximate number of stimulus values in each block of spike-triggered
+# samples processed at a time by `sta` and `stc` (8 MB in double precision)
+_STE_BLOCK_ELEMENTS = 2 ** 20
+
+# BLAS symmetric rank-1 and rank-k update routines used by `stc`, for each
+# of the floating point types returned by `_float_dtype`
+_SYR = {np.dtype('float64'): dsyr, np.dtype('float32'): ssyr}
+_SYRK = {np.dtype('float64'): dsyrk, np.dtype('float32'): ssyrk}
+
 
 def ste(time, stimulus, spikes, nsamples_before, nsamples_after=0):
     """
@@ -56,14 +65,12 @@ def ste(time, stimulus, spikes, nsamples_before, nsamples_after=0):
     """
     nb, na = nsamples_before, nsamples_after
 
-    # Bin spikes
-    (hist, bins) = np.histogram(spikes, time)
-
     # Get indices of non-zero firing, truncating spikes before nsamples_before
     # or after nsamples_after
-    slices = (stimulus[(idx - nb):(idx + na), ...].astype('float64')
-              for idx in np.where(hist > 0)[0]
-              if (idx > nb and (idx + na) < len(stimulus)))
+    indices = _spike_indices(time, len(stimulus), spikes, nb, na)
+    dtype = _float_dtype(stimulus)
+    slices = (stimulus[(idx - nb):(idx + na), ...].astype(dtype)
+              for idx in indices)
 
     # return the iterator
     return slices
@@ -129,22 +136,30 @@ def sta(time, stimulus, spikes, nsamples_before, nsamples_after=0):
 
     """
 
-    # get the iterator
-    ste_it = ste(time, stimulus, spikes, nsamples_before, nsamples_after=nsamples_after)
+    nb, na = nsamples_before, nsamples_after
 
     # time axis
-    filter_length = nsamples_before + nsamples_after
-    dt = np.mean(np.diff(time))
-    tax = dt * np.arange(-nsamples_before, nsamples_after) + dt
-
-    # reduce
-    try:
-        first = next(ste_it)  # check for empty generators
-        sta = reduce(lambda sta, x: np.add(sta, x),
-                     ste_it, first) / float(len(spikes))
-    except StopIteration:
+    filter_length = nb + na
+    dt = _sampling_period(time)
+    tax = dt * np.arange(-nb, na) + dt
+
+    # get the indices of the spike-triggered stimuli
+    indices = _spike_indices(time, len(stimulus), spikes, nb, na)
+    if indices.size == 0:
         return (np.nan * np.ones((filter_length,) + stimulus.shape[1:]), tax)
 
+    # sum the spike-triggered ensemble from a strided view onto the
+    # stimulus, gathering a block of samples at a time rather than slicing
+    # it once per spike (this keeps memory bounded to one block)
+    slices = slicestim(stimulus, int(nb), int(na))
+    dtype = _float_dtype(stimulus)
+    sta = np.zeros(slices.shape[1:], dtype=dtype)
+    block_size = _ste_block_size(sta.size)
+    for start in range(0, indices.size, block_size):
+        block = slices[indices[start:start + block_size] - nb]
+        sta += block.sum(axis=0, dtype=dtype)
+    sta /= float(len(spikes))
+
     return sta, tax
 
 
@@ -177,40 +192,50 @@ def stc(time, stimulus, spikes, nsamples_before, nsamples_after=0):
         The spike-triggered covariance (STC) matrix.
 
     """
-    # get the blas function for computing the outer product
-    outer = scipy.linalg.blas.get_blas_funcs('syr', dtype='d')
-
-    # get the iterator
-    ste_it = ste(time, stimulus, spikes, nsamples_before, nsamples_after=nsamples_after)
-
-    filter_length = nsamples_before + nsamples_after
+    nb, na = nsamples_before, nsamples_after
+    filter_length = nb + na
 
-    # check if empty
-    first = next(ste_it, None)
+    # get the indices of the spike-triggered stimuli
+    indices = _spike_indices(time, len(stimulus), spikes, nb, na)
 
     # if the spike-triggered ensemble is empty, return an array of NaN's
-    if first is None:
+    if indices.size == 0:
         ndims = int(np.prod(stimulus.shape[1:]) * filter_length)
         return np.nan * np.ones((ndims, ndims))
 
-    # initialize the STC matrix using the outer product of the first sample
-    stc_init = np.triu(np.outer(first.ravel(), first.ravel()))
-
-    # reduce the stc using the BLAS outer product function
+    # accumulate the outer products of the spike-triggered ensemble, using
+    # a BLAS symmetric rank-k update on each block of samples. This keeps
+    # memory bounded to one block of the ensemble at a time. Passing the
+    # transpose of each block hands BLAS a Fortran-ordered array, and the
+    # STC matrix is itself stored in Fortran order so that it is updated
+    # in place, rather than copied on every call.
     # (note: this only fills in the upper triangular part of the matrix)
-    stc_ut = reduce(lambda C, x: outer(1, x.ravel(), a=C), ste_it, stc_init)
+    slices = slicestim(stimulus, int(nb), int(na))
+    ndims = int(np.prod(stimulus.shape[1:]) * filter_length)
+    dtype = _float_dtype(stimulus)
+    stc_ut = np.zeros((ndims, ndims), dtype=dtype, order='F')
+    s = np.zeros(ndims, dtype=dtype)
+    syrk = _SYRK[dtype]
+    block_size = _ste_block_size(ndims)
+    for start in range(0, indices.size, block_size):
+        block = flat2d(slices[indices[start:start + block_size] - nb])
+        block = block.astype(dtype, copy=False)
+        stc_ut = syrk(1.0, block.T, beta=1.0, c=stc_ut, overwrite_c=1)
+        s += block.sum(axis=0)
 
     # normalize by the number of spikes
     stc_ut /= float(len(spikes))
 
-    # compute the STA (to remove it)
-    s = sta(time, stimulus, spikes, filter_length)[0].ravel()
+    # compute the STA, and subtract off its outer product (in place, using
+    # a BLAS symmetric rank-1 update of the upper triangular part)
+    s /= float(len(spikes))
+    stc_ut = _SYR[dtype](-1.0, s, a=stc_ut, overwrite_a=1)
 
     # fill in the lower triangular portion (by adding the transpose)
-    # and subtract off the STA to compute the full STC matrix
-    stc = np.triu(stc_ut, 1).T + stc_ut - np.outer(s, s)
+    # to compute the full STC matrix
+    stc_ut += np.triu(stc_ut, 1).T
 
-    return stc
+    return stc_ut
 
 
 def lowranksta(sta_orig, k=10):
@@ -253,7 +278,7 @@ def lowranksta(sta_orig, k=10):
     """
 
     # work with a copy of the STA (prevents corrupting the input)
-    f = sta_orig.copy() - sta_orig.mean()
+    f = sta_orig - sta_orig.mean()
 
     # Compute the SVD of the full STA
     assert f.ndim >= 2, "STA must be at least 2-D"
@@ -500,11 +525,11 @@ def normalize_spatial(frame, scale_factor=1.0, clip_negative=False):
     mu = f[(f <= outlier_threshold) & (f >= -outlier_threshold)].mean()
 
     # normalize by the standard deviation of the pixel values
-    f_centered = f - mu
-    f_centered /= f_centered.std()
+    f -= mu
+    f /= f.std()
 
     # resample by the given amount
-    f_resampled = resample(f_centered, scale_factor)
+    f_resampled = resample(f, scale_factor)
 
     # clip negative values
     if clip_negative:
@@ -665,7 +690,9 @@ def linear_response(filt, stim, nsamples_after=0):
     Raises
     ------
     ValueError : If the number of dimensions of ``stim`` and ``filt`` do not
-        match, or if the spatial dimensions differ.
+        match, if the spatial dimensions differ, if ``filt`` has more
+        time points than ``stim``, or if ``nsamples_after`` is not an
+        integer between 0 and the number of time points in ``filt``.
 
     Notes
     -----
@@ -679,8 +706,32 @@ def linear_response(filt, stim, nsamples_after=0):
         raise ValueError("The filter and stimulus must have the same " +
                          "number of dimensions and match in size along spatial dimensions")
 
-    slices = slicestim(stim, filt.shape[0] - nsamples_after, nsamples_after)
-    return np.einsum('tx,x->t', flat2d(slices), filt.ravel())
+    if filt.shape[0] > stim.shape[0]:
+        raise ValueError("The filter cannot have more time points than the stimulus")
+
+    if not isinstance(nsamples_after, int):
+        raise ValueError("`nsamples_after` must be an integer")
+    elif not (0 <= nsamples_after <= filt.shape[0]):
+        raise ValueError("`nsamples_after` must be between 0 and {0:#d}".format(
+            filt.shape[0]))
+
+    # a purely temporal filter is just a correlation with the stimulus
+    if stim.ndim == 1:
+        return np.correlate(stim, filt, mode='valid')
+
+    # with few spatial dimensions relative to the filter length, contract
+    # the filter with a (zero-copy) view of the sliced stimulus directly
+    nsamples_before = filt.shape[0] - nsamples_after
+    if np.prod(stim.shape[1:]) < filt.shape[0]:
+        slices = slicestim(stim, nsamples_before, nsamples_after)
+        return np.einsum('tx,x->t', flat2d(slices), filt.ravel())
+
+    # otherwise, project every stimulus frame onto every time point of the
+    # filter with a single matrix product (no larger than the stimulus), then
+    # sum those projections along the diagonal of each filter-length window
+    proj = flat2d(stim).dot(flat2d(filt).T)
+    slices = slicestim(proj, nsamples_before, nsamples_after)
+    return np.einsum('tkk->t', slices)
 
 
 def revcorr(stimulus, response, nsamples_before, nsamples_after=0):
@@ -763,6 +814,58 @@ def revcorr(stimulus, response, nsamples_before, nsamples_after=0):
     return recovered, lags
 
 
+def _float_dtype(stimulus):
+    """
+    Returns the floating point type used for computations on the given
+    stimulus. Single-precision stimuli are kept in single precision, and
+    all others (including integer stimuli) are promoted to double precision.
+    """
+    return np.dtype('float32') if stimulus.dtype == np.float32 else np.dtype('float64')
+
+
+def _ste_block_size(ndims):
+    """
+    Returns the number of spike-triggered samples, each with the given
+    number of dimensions, to gather into memory at a time.
+    """
+    return max(1, _STE_BLOCK_ELEMENTS // ndims)
+
+
+def _spike_indices(time, nsamples, spikes, nsamples_before, nsamples_after=0):
+    """
+    Returns the indices of the time bins which contain at least one spike,
+    ignoring those bins too close to either end of the stimulus to have
+    a full spike-triggered stimulus.
+
+    Parameters
+    ----------
+    time : ndarray
+        The time array corresponding to the stimulus.
+
+    nsamples : int
+        The number of time points in the stimulus.
+
+    spikes : iterable
+        A list or ndarray of spike times.
+
+    nsamples_before : int
+        Number of samples to include before the spike.
+
+    nsamples_after : int
+        Number of samples to include after the spike (default: 0).
+
+    Returns
+    -------
+    indices : ndarray
+        The indices into the time axis of the stimulus of each spike.
+
+    """
+    hist = np.histogram(spikes, time)[0]
+    indices = np.where(hist > 0)[0]
+    valid = (indices > nsamples_before) & ((indices + nsamples_after) < nsamples)
+    return indices[valid]
+
+
 def _gaussian_function(data, x0, y0, a, b, c):
     """
     A 2D gaussian function (used for fitting an ellipse to RFs)
@@ -8,11 +8,19 @@ for smoothing a histogram into a firing rate (`estfr`)
 """
 import sys
 import numpy as np
+import scipy.ndimage
+import scipy.signal
 import matplotlib.pyplot as plt
 from collections import Counter
+from pyret.utils import _sampling_period
 
 __all__ = ['binspikes', 'estfr', 'detectevents', 'peakdet', 'SpikingEvent']
 
+# Cache of Gaussian filters used by `estfr`, keyed on (sigma, dt), and
+# the maximum number of filters it holds before being cleared
+_GAUSSIAN_KERNELS = {}
+_GAUSSIAN_KERNELS_MAXSIZE = 32
+
 
 def binspikes(spk, time):
     """
@@ -31,7 +39,36 @@ def binspikes(spk, time):
     bspk : array_like
         Binned spike times
     """
+    # there is nothing to bin if there are no spikes
+    spk = np.asarray(spk)
+    if spk.size == 0:
+        return np.zeros(len(time))
+
     bin_edges = np.append(time, 2 * time[-1] - time[-2])
+
+    # Uniformly spaced bins can be counted directly, avoiding the binary
+    # search over the bin edges that np.histogram performs for each spike.
+    # The edges must lie on a regular lattice (to well within one bin), so
+    # that the computed bin of each spike is off by at most one.
+    nbins = bin_edges.size - 1
+    dt = (bin_edges[-1] - bin_edges[0]) / nbins
+    lattice = bin_edges[0] + dt * np.arange(bin_edges.size)
+    if np.max(np.abs(bin_edges - lattice)) < 0.01 * dt:
+        binned = spk[(spk >= bin_edges[0]) & (spk <= bin_edges[-1])]
+        indices = np.floor((binned - bin_edges[0]) / dt).astype(np.intp)
+        np.clip(indices, 0, nbins - 1, out=indices)
+
+        # correct for round-off, so that spikes are binned exactly as
+        # np.histogram would (the last bin includes its right edge)
+        indices -= binned < bin_edges[indices]
+        indices += (binned >= bin_edges[indices + 1]) & (indices < nbins - 1)
+
+        # only use the counts if every spike is now in its correct bin
+        correct = ((bin_edges[indices] <= binned) &
+                   ((binned < bin_edges[indices + 1]) | (indices == nbins - 1)))
+        if np.all(correct):
+            return np.bincount(indices, minlength=nbins).astype(float)
+
     return np.histogram(spk, bins=bin_edges)[0].astype(float)
 
 
@@ -56,20 +93,96 @@ def estfr(bspk, time, sigma=0.01):
         Array of estimated instantaneous firing rate
     """
     # estimate the time resolution
-    dt = float(np.mean(np.diff(time)))
+    dt = _sampling_period(time)
 
-    # Construct Gaussian filter, make sure it is normalized
-    tau = np.arange(-5 * sigma, 5 * sigma, dt)
-    filt = np.exp(-0.5 * (tau / sigma) ** 2)
-    filt = filt / np.sum(filt)
+    # Get the (normalized) Gaussian filter
+    filt = _gaussian_kernel(sigma, dt)
     size = int(np.round(filt.size / 2))
 
-    # Filter  binned spike times
-    return np.convolve(filt, bspk, mode='full')[size:size + time.size] / dt
+    # Filter binned spike times, using an FFT for wide filters
+    rates = scipy.signal.convolve(bspk, filt, mode='full',
+                                  method='auto')[size:size + time.size]
+
+    # Discard the round-off error of an FFT, which is far smaller than any
+    # rate from an actual spike, so that rates are exactly zero away from
+    # the spikes
+    tol = 10 * np.finfo(rates.dtype).eps * np.abs(bspk).sum() * filt.max()
+    rates[np.abs(rates) < tol] = 0.
+    rates /= dt
+    return rates
+
+
+def _gaussian_kernel(sigma, dt):
+    """
+    Returns a normalized Gaussian filter, extending to 5 standard deviations
+    on either side of zero, sampled at the given time resolution.
+
+    Filters are cached, as `estfr` is often called repeatedly with the same
+    parameters. The cache is cleared once it holds `_GAUSSIAN_KERNELS_MAXSIZE`
+    filters. The returned array is read-only.
+
+    Parameters
+    ----------
+    sigma : float
+        The width of the Gaussian filter, in seconds
+
+    dt : float
+        The time resolution of the filter, in seconds
+
+    Returns
+    -------
+    filt : array_like
+        The Gaussian filter, normalized to sum to 1
+    """
+    key = (sigma, dt)
+    if key not in _GAUSSIAN_KERNELS:
+        if len(_GAUSSIAN_KERNELS) >= _GAUSSIAN_KERNELS_MAXSIZE:
+            _GAUSSIAN_KERNELS.clear()
+        tau = np.arange(-5 * sigma, 5 * sigma, dt)
+        filt = np.exp(-0.5 * (tau / sigma) ** 2)
+        filt /= np.sum(filt)
+        filt.flags.writeable = False
+        _GAUSSIAN_KERNELS[key] = filt
+    return _GAUSSIAN_KERNELS[key]
+
+
+def _psth(spk, time, sigma=0.01):
+    """
+    Bin spike times and smooth them into a firing rate in one pass, using
+    a (truncated) Gaussian filter applied directly to the binned spikes.
+
+    This is equivalent to calling `binspikes` followed by `estfr`, but
+    avoids constructing and normalizing the Gaussian filter explicitly.
+
+    Parameters
+    ----------
+    spk : array_like
+        Array of spike times
+
+    time : array_like
+        The left edges of the time bins
+
+    sigma : float, optional
+        The width of the Gaussian filter, in seconds (Default: 0.01 seconds)
+
+    Returns
+    -------
+    bspk : array_like
+        Binned spike times
+
+    rates : array_like
+        Array of estimated instantaneous firing rate
+    """
+    bspk = binspikes(spk, time)
+    dt = _sampling_period(time)
+    rates = scipy.ndimage.gaussian_filter1d(bspk, sigma / dt, mode='constant',
+                                            truncate=5.0)
+    rates /= dt
+    return bspk, rates
 
 
 class SpikingEvent(object):
-    def __init__(self, start_time, stop_time, spikes):
+    def __init__(self, start_time, stop_time, spikes, trials=None):
         """
         The spiking event class bundles together functions that are used to analyze
         individual firing events, consisting of spiking activity recorded across
@@ -84,18 +197,65 @@ class SpikingEvent(object):
             the stop time of the firing event
 
         spikes : array_like
-            the spikes associated with this firing event. This data is stored as an
-            (n by 2) numpy array, where the first column is the set of spike times
-            in the event and the second column is a list of corresponding
-            trial/cell/condition indices for each spike
+            the spikes associated with this firing event, as an (n by 2) array,
+            where the first column is the set of spike times in the event and
+            the second column is a list of corresponding trial/cell/condition
+            indices for each spike. If `trials` is given, this is instead just
+            the (n,) array of spike times
+
+        trials : array_like, optional
+            the (n,) array of trial/cell/condition indices for each spike
+            (Default: None, the indices are taken from `spikes`)
+
+        The spike times and trial indices are stored separately, as the
+        `times` (float) and `trials` (integer) attributes.
         """
         self.start = start_time
         self.stop = stop_time
-        self.spikes = spikes
+
+        if trials is None:
+            self.spikes = spikes
+        else:
+            self._set_spikes(spikes, trials)
+
+    @property
+    def spikes(self):
+        """
+        The (n by 2) array of spike times and trial indices
+
+        This array is built from the `times` and `trials` attributes on each
+        access, and so is read-only: modify `times` or `trials` instead (or
+        assign a new array to `spikes`).
+        """
+        spikes = np.column_stack((self.times, self.trials))
+        spikes.flags.writeable = False
+        return spikes
+
+    @spikes.setter
+    def spikes(self, spikes):
+        spikes = np.atleast_2d(np.asarray(spikes))
+        if spikes.size == 0:
+            spikes = np.zeros((0, 2))
+        elif spikes.ndim != 2 or spikes.shape[1] < 2:
+            raise ValueError("spikes must be an (n by 2) array of spike "
+                             "times and trial indices")
+        self._set_spikes(spikes[:, 0], spikes[:, 1])
+
+    def _set_spikes(self, times, trials):
+        """Validate and store the spike times and their trial indices"""
+        times = np.asarray(times, dtype=np.float64)
+        trials = np.asarray(trials)
+        if times.ndim != 1 or trials.ndim != 1 or times.size != trials.size:
+            raise ValueError("spike times and trial indices must be 1-D "
+                             "arrays of the same length")
+        if np.any(trials != np.round(trials)):
+            raise ValueError("trial indices must be integers")
+        self.times = times
+        self.trials = trials.astype(np.int32)
 
     def __str__(self):
         return '%5.2fs - %5.2fs (%i spikes)' % (self.start, self.stop,
-                                                self.spikes.shape[0])
+                                                self.times.size)
 
     def __eq__(self, other):
         """
@@ -107,7 +267,7 @@ class SpikingEvent(object):
 
     def trial_counts(self):
         """Count the number of spikes per trial"""
-        return Counter(self.spikes[:, 1])
+        return Counter(self.trials)
 
     def stats(self):
         """
@@ -130,8 +290,29 @@ class SpikingEvent(object):
         >> times = spkevent.ttfs()
 
         """
-        trials, indices = np.unique(self.spikes[:, 1], return_index=True)[:2]
-        return self.spikes[indices, 0]
+        return self._first_spikes()[1]
+
+    def _first_spikes(self):
+        """
+        Finds the time of the first spike in each trial, regardless of the
+        order in which the spikes are stored
+
+        Returns
+        -------
+        trials : array_like
+            The (sorted) unique trial indices
+
+        first_times : array_like
+            The time of the first spike in each of those trials
+        """
+        if self.times.size == 0:
+            return self.trials.copy(), self.times.copy()
+
+        # group the spikes by trial, and take the minimum time in each group
+        order = np.argsort(self.trials, kind='mergesort')
+        trials = self.trials[order]
+        starts = np.concatenate(([0], np.where(np.diff(trials) != 0)[0] + 1))
+        return trials[starts], np.minimum.reduceat(self.times[order], starts)
 
     def jitter(self):
         """
@@ -150,21 +331,19 @@ class SpikingEvent(object):
 
         """
 
-        # get first spike in each trial
-        trial_indices = np.unique(self.spikes[:, 1], return_index=True)[1]
+        # get first spike in each trial, and the trial of each spike
+        trials, first_times = self._first_spikes()
+        trial_indices = np.searchsorted(trials, self.trials)
 
         # sort by time of first spike
-        sorted_indices = np.argsort(self.spikes[trial_indices, 0])
+        sorted_indices = np.argsort(first_times, kind='mergesort')
 
-        # get reassigned trials
-        sorted_trials = self.spikes[trial_indices[sorted_indices], 1]
+        # map each trial to its (1-based) rank in the sorted order
+        ranks = np.empty(first_times.size, dtype=self.trials.dtype)
+        ranks[sorted_indices] = np.arange(1, first_times.size + 1)
 
         # store new spiking array, resetting trial numbers
-        sortedspikes = self.spikes.copy()
-        for idx in range(sorted_trials.size):
-            sortedspikes[self.spikes[:, 1] == sorted_trials[idx], 1] = idx + 1
-
-        return sortedspikes
+        return np.column_stack((self.times, ranks[trial_indices]))
 
     def plot(self, sort=False, ax=None, color='SlateGray'):
         """
@@ -186,14 +365,14 @@ class SpikingEvent(object):
         """
 
         if sort:
-            spikes = self.sort()
+            trials = self.sort()[:, 1]
         else:
-            spikes = self.spikes
+            trials = self.trials
 
         if not ax:
             ax = plt.figure().add_subplot(111)
 
-        ax.plot(spikes[:, 0], spikes[:, 1], 'o', markersize=6,
+        ax.plot(self.times, trials, 'o', markersize=6,
                 markerfacecolor=color)
 
 
@@ -213,7 +392,10 @@ def detectevents(spk, threshold=(0.3, 0.05)):
 
     threshold : (float, float), optional
         A tuple of two floats that are used as thresholds for detecting firing
-        events. Default: (0.1, 0.005) see `peakdet` for more info
+        events. Default: (0.3, 0.05). The first is the minimum prominence of
+        a peak in the PSTH (as in `peakdet`, see `scipy.signal.find_peaks`),
+        and the second is the PSTH value below which an event ends. As with
+        `peakdet`, a peak at the very start of the PSTH is also detected.
 
     Returns
     -------
@@ -223,44 +405,47 @@ def detectevents(spk, threshold=(0.3, 0.05)):
     """
     # find peaks in the PSTH
     time = np.arange(0, np.ceil(spk[:, 0].max()), 0.01)
-    bspk = binspikes(spk[:, 0], time)
-    psth = estfr(bspk, time, sigma=0.01)
-    maxtab, _ = peakdet(psth, threshold[0], time)
-
-    # store spiking events in a list
-    events = list()
-
-    # join similar peaks, define events
-    for eventidx in range(maxtab.shape[0]):
-
-        # get putative start and stop indices of each spiking event
-        start_indices = np.where((psth <= threshold[1]) &
-                                 (time < maxtab[eventidx, 0]))[0]
-        stop_indices = np.where((psth <= threshold[1]) &
-                                (time > maxtab[eventidx, 0]))[0]
-
-        # find the start time, defined as the right most peak index
-        if start_indices.size == 0:
-            starttime = time[0]
-        else:
-            starttime = time[np.max(start_indices)]
-
-        # find the stop time, defined as the lest most peak index
-        if stop_indices.size == 0:
-            stoptime = time[-1]
-        else:
-            stoptime = time[np.min(stop_indices)]
-
-        # find spikes within this time interval
-        event_spikes = spk[(spk[:, 0] >= starttime) &
-                           (spk[:, 0] < stoptime), :]
-
-        # create the spiking event
-        event = SpikingEvent(starttime, stoptime, event_spikes)
-
-        # only add it if it is a unique event
-        if not events or not (events[-1] == event):
-            events.append(event)
+    bspk, psth = _psth(spk[:, 0], time, sigma=0.01)
+    # (padding the start of the PSTH with its minimum, so that a peak at the
+    # start of the time axis is found as well, as it was by `peakdet`)
+    peaks = scipy.signal.find_peaks(np.concatenate(([psth.min()], psth)),
+                                    prominence=threshold[0])[0] - 1
+
+    # get putative start and stop indices of each spiking event, which are
+    # the points where the PSTH falls below the lower threshold
+    crossings = np.where(psth <= threshold[1])[0]
+
+    # for each peak, find the last crossing before it (the right most
+    # start index) and the first crossing after it (the left most stop index)
+    start_indices = np.searchsorted(crossings, peaks) - 1
+    stop_indices = np.searchsorted(crossings, peaks + 1)
+
+    # find the start and stop times, defaulting to the ends of the time axis
+    starttimes = np.full(peaks.shape, time[0])
+    has_start = start_indices >= 0
+    starttimes[has_start] = time[crossings[start_indices[has_start]]]
+    stoptimes = np.full(peaks.shape, time[-1])
+    has_stop = stop_indices < crossings.size
+    stoptimes[has_stop] = time[crossings[stop_indices[has_stop]]]
+
+    # join similar peaks, by keeping only the first of consecutive peaks
+    # sharing the same start and stop times
+    unique = np.ones(peaks.shape, dtype=bool)
+    unique[1:] = (np.diff(starttimes) != 0) | (np.diff(stoptimes) != 0)
+    starttimes, stoptimes = starttimes[unique], stoptimes[unique]
+
+    # find the range of spikes within each event's time interval, by
+    # searching the sorted spike times
+    order = np.argsort(spk[:, 0], kind='mergesort')
+    sorted_times = spk[order, 0]
+    first_spikes = np.searchsorted(sorted_times, starttimes, side='left')
+    last_spikes = np.searchsorted(sorted_times, stoptimes, side='left')
+
+    # define events, from the spikes within each time interval (in their
+    # original order)
+    events = [SpikingEvent(starttime, stoptime, spk[np.sort(order[lo:hi]), :])
+              for starttime, stoptime, lo, hi in zip(starttimes, stoptimes,
+                                                     first_spikes, last_spikes)]
 
     return time, psth, bspk, events
 
@@ -42,20 +42,14 @@ def upsample(stim, upsample_factor, time=None):
     if time is None:
         return stim_us, None
 
-    # Upsample the time vecctor if given
-    x = np.arange(0, upsample_factor * time.size)
-    xp = np.arange(0, upsample_factor * time.size, upsample_factor)
-    time_us = np.interp(x, xp, np.squeeze(time))
-
-    # Check that last k timestamps are valid. np.interp does no
-    # extrapolation, which may be necessary for the last
-    # timepoint, given the method above
-    modified_time_us = time_us.copy()
-    dt = np.diff(time_us).mean()
-    for k in reversed(np.arange(upsample_factor) + 1):
-        if np.allclose(time_us[-(k + 1)], time_us[-k]):
-            modified_time_us[-k] = modified_time_us[-(k + 1)] + dt
-    time_us = modified_time_us.copy()
+    # Upsample the time vector if given, by linearly interpolating within
+    # each original time step. The last step is repeated, to extrapolate
+    # the timestamps following the final original timepoint.
+    time = np.squeeze(time)
+    steps = np.diff(time)
+    steps = np.append(steps, steps[-1])
+    offsets = np.arange(upsample_factor) / float(upsample_factor)
+    time_us = (time[:, np.newaxis] + steps[:, np.newaxis] * offsets).ravel()
 
     return stim_us, time_us
 
@@ -78,7 +72,9 @@ def downsample(stim, downsample_factor, time=None):
     Returns
     -------
     stim_ds : array_like
-        The downsampled stimulus array
+        The downsampled stimulus array. This is a view onto the original
+        stimulus array; use ``np.ascontiguousarray(stim_ds)`` if an
+        independent copy is needed.
 
     time_ds : array_like
         The downsampled time vector
@@ -86,7 +82,7 @@ def downsample(stim, downsample_factor, time=None):
     """
 
     # Downsample the stimulus array
-    stim_ds = np.take(stim, np.arange(0, stim.shape[0], downsample_factor), axis=0)
+    stim_ds = stim[::downsample_factor, ...]
 
     # Downsample the time vector, if given
     time_ds = time[::downsample_factor] if time is not None else None
@@ -3,6 +3,7 @@ pyret utilities
 """
 
 from functools import wraps
+import numpy as np
 import matplotlib.pyplot as plt
 
 
@@ -15,6 +16,18 @@ def flat2d(x):
     return x.reshape(x.shape[0], -1)
 
 
+def _sampling_period(time):
+    """Returns the mean time step of the given time vector
+
+    The mean of the time steps telescopes to the total duration over the
+    number of steps, so this takes constant time. A time vector with fewer
+    than two samples has no time step, and gives NaN.
+    """
+    if len(time) < 2:
+        return np.nan
+    return float(time[-1] - time[0]) / (len(time) - 1)
+
+
 def plotwrapper(func):
     """Decorator that adds axis and figure keyword arguments to the kwargs
     of a function"""
@@ -25,7 +25,7 @@ setup(name='pyret',
       packages=find_packages(),
       install_requires=[
           'numpy>=1.11',
-          'scipy>=0.18',
+          'scipy>=1.1',
           'matplotlib>=1.5',
           'scikit-image>=0.12',
           'scikit-learn>=0.18'
@@ -40,6 +40,11 @@ def test_sta():
     assert np.allclose(tmp, sta)
     assert np.allclose(tax, np.arange(-filter_length + 1, 1))
 
+    # a single time sample has no time step, and gives NaNs
+    sta, tax = flt.sta(np.array([0.]), np.zeros((1, 2)), [0.5], 1)
+    assert np.all(np.isnan(sta))
+    assert np.all(np.isnan(tax))
+
 def test_sta_acausal():
     """Test computing a spike-triggered average with points before and
     after the time of the spike.
@@ -59,6 +64,25 @@ def test_sta_acausal():
     assert np.allclose(tmp, sta)
     assert np.allclose(tax, np.arange(-nbefore + 1, nafter + 1))
 
+def test_sta_nd():
+    """Test computing a spike-triggered average of a spatiotemporal stimulus,
+    including multiple spikes falling in the same time bin.
+    """
+    np.random.seed(0)
+    time = np.arange(100)
+    spikes = np.array((0, 30, 30.5, 70))
+    stimulus = np.random.randn(100, 3, 4)
+    filter_length = 5
+
+    sta, _ = flt.sta(time, stimulus, spikes, filter_length)
+    tmp = np.zeros(sta.shape)
+    for s in flt.ste(time, stimulus, spikes, filter_length):
+        tmp += s
+    tmp /= len(spikes)
+
+    assert sta.shape == (filter_length,) + stimulus.shape[1:]
+    assert np.allclose(tmp, sta)
+
 def test_empty_sta():
     """Test that an empty with no spikes returns an array of nans"""
     np.random.seed(0)
@@ -86,6 +110,64 @@ def test_stc():
     atol = 0.1
     assert np.allclose(tmp, np.eye(filter_length), atol=atol)
 
+def test_stc_nd():
+    """Test the STC of a spatiotemporal stimulus against the explicit sum
+    of outer products of the spike-triggered ensemble.
+    """
+    np.random.seed(0)
+    time = np.arange(200)
+    spikes = np.random.randint(0, 200, (50,))
+    stimulus = np.random.randn(200, 2, 3)
+    nbefore, nafter = 4, 1
+
+    tmp = flt.stc(time, stimulus, spikes, nbefore, nafter)
+    ensemble = np.array([s.ravel() for s in
+                         flt.ste(time, stimulus, spikes, nbefore, nafter)])
+    mean = ensemble.sum(axis=0) / len(spikes)
+    expected = ensemble.T.dot(ensemble) / len(spikes) - np.outer(mean, mean)
+
+    assert np.allclose(tmp, expected)
+
+def test_ste_blocks(monkeypatch):
+    """Test that the STA and STC do not depend on the number of
+    spike-triggered samples processed at a time.
+    """
+    np.random.seed(0)
+    time = np.arange(200)
+    spikes = np.random.randint(0, 200, (50,))
+    stimulus = np.random.randn(200, 2)
+    filter_length = 5
+
+    expected_sta = flt.sta(time, stimulus, spikes, filter_length)[0]
+    expected_stc = flt.stc(time, stimulus, spikes, filter_length)
+    monkeypatch.setattr(flt, '_STE_BLOCK_ELEMENTS', 7 * 2 * filter_length)
+    assert np.allclose(flt.sta(time, stimulus, spikes, filter_length)[0], expected_sta)
+    assert np.allclose(flt.stc(time, stimulus, spikes, filter_length), expected_stc)
+
+def test_single_precision():
+    """Test that single-precision stimuli are kept in single precision."""
+    np.random.seed(0)
+    time = np.arange(200)
+    spikes = np.random.randint(0, 200, (50,))
+    stimulus = np.random.randn(200, 2)
+    filter_length = 5
+
+    expected = flt.sta(time, stimulus, spikes, filter_length)[0]
+    single = flt.sta(time, stimulus.astype('float32'), spikes, filter_length)[0]
+    assert single.dtype == np.float32
+    assert np.allclose(single, expected, atol=1e-5)
+
+    expected = flt.stc(time, stimulus, spikes, filter_length)
+    single = flt.stc(time, stimulus.astype('float32'), spikes, filter_length)
+    assert single.dtype == np.float32
+    assert single.shape == expected.shape
+    assert np.allclose(single, expected, atol=1e-5)
+
+    ste = flt.ste(time, stimulus.astype('float32'), spikes, filter_length)
+    assert next(ste).dtype == np.float32
+    ste = flt.ste(time, (100 * stimulus).astype('int16'), spikes, filter_length)
+    assert next(ste).dtype == np.float64
+
 def test_empty_stc():
     """Test STC with no spike returns array of nans"""
     np.random.seed(0)
@@ -244,6 +326,21 @@ def test_linear_response_nd():
         assert np.allclose(tmp, pred)
 
 
+def test_linear_response_paths():
+    """Test computing a linear response both for stimuli with few spatial
+    dimensions relative to the filter length, and with many.
+    """
+    np.random.seed(0)
+    for nspace in (2, 30):
+        filt = np.random.randn(20, nspace)
+        stim = np.random.randn(500, nspace)
+        for nafter in (0, 5):
+            pred = flt.linear_response(filt, stim, nafter)
+            sl = slicestim(stim, filt.shape[0] - nafter, nafter)
+            expected = np.einsum('tx,x->t', sl.reshape(sl.shape[0], -1), filt.ravel())
+            assert np.allclose(expected, pred)
+
+
 def test_linear_response_raises():
     """Test raising ValueErrors with incorrect inputs"""
     np.random.seed(0)
@@ -251,6 +348,16 @@ def test_linear_response_raises():
         flt.linear_response(np.random.randn(10,), np.random.randn(10,2))
     with pytest.raises(ValueError):
         flt.linear_response(np.random.randn(10, 2), np.random.randn(10, 3))
+    with pytest.raises(ValueError):
+        flt.linear_response(np.ones(10,), np.ones(5,))
+    with pytest.raises(ValueError):
+        flt.linear_response(np.ones((10, 2)), np.ones((5, 2)))
+    for nsamples_after in (2.5, -3, 11):
+        with pytest.raises(ValueError):
+            flt.linear_response(np.ones(10,), np.ones(20,), nsamples_after)
+        with pytest.raises(ValueError):
+            flt.linear_response(np.ones((10, 2)), np.ones((20, 2)),
+                                nsamples_after)
 
 
 def test_revcorr_raises():
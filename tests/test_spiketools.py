@@ -2,6 +2,7 @@
 Tests functions in the spiketools module
 """
 import numpy as np
+import pytest
 import pyret.spiketools as spk
 
 
@@ -22,6 +23,47 @@ def test_binspikes():
     assert np.allclose(spk.binspikes([], bin_edges), np.zeros_like(bin_edges))
 
 
+def test_gaussian_kernel_cache():
+
+    # the filter cache does not grow without bound
+    for dt in np.linspace(1e-3, 2e-3, 2 * spk._GAUSSIAN_KERNELS_MAXSIZE):
+        filt = spk._gaussian_kernel(0.01, dt)
+        assert len(spk._GAUSSIAN_KERNELS) <= spk._GAUSSIAN_KERNELS_MAXSIZE
+    assert spk._gaussian_kernel(0.01, dt) is filt
+    assert np.isclose(filt.sum(), 1)
+
+
+def test_binspikes_matches_histogram():
+
+    np.random.seed(0)
+    spike_times = np.random.uniform(-1, 11, size=10000)
+
+    # uniform bins
+    time = np.arange(0, 10, 1e-3)
+    bin_edges = np.append(time, 2 * time[-1] - time[-2])
+    expected = np.histogram(spike_times, bins=bin_edges)[0]
+    assert np.array_equal(spk.binspikes(spike_times, time), expected)
+
+    # spikes falling exactly on the bin edges
+    expected = np.histogram(bin_edges, bins=bin_edges)[0]
+    assert np.array_equal(spk.binspikes(bin_edges, time), expected)
+
+    # bin edges which drift away from a regular lattice
+    steps = np.full(200000, 1. / 60)
+    steps[0] += 1.5e-7
+    time = np.concatenate(([0.], np.cumsum(steps)))[:-1]
+    drift_times = np.random.uniform(0, time[-1], size=10000)
+    bin_edges = np.append(time, 2 * time[-1] - time[-2])
+    expected = np.histogram(drift_times, bins=bin_edges)[0]
+    assert np.array_equal(spk.binspikes(drift_times, time), expected)
+
+    # non-uniform bins
+    time = np.sort(np.random.uniform(0, 10, size=1000))
+    bin_edges = np.append(time, 2 * time[-1] - time[-2])
+    expected = np.histogram(spike_times, bins=bin_edges)[0]
+    assert np.array_equal(spk.binspikes(spike_times, time), expected)
+
+
 def test_estfr():
 
     T = 100
@@ -39,6 +81,55 @@ def test_estfr():
     assert (fr.sum() * dt) == bspk.sum()
 
 
+def test_estfr_filter_sizes():
+
+    # compare against direct convolution with a wide Gaussian filter
+    np.random.seed(0)
+    dt = 1e-3
+    sigma = 0.1
+    time = np.arange(0, 20, dt)
+    bspk = np.random.poisson(0.1, size=time.size).astype(float)
+    fr = spk.estfr(bspk, time, sigma=sigma)
+
+    def expected(sigma):
+        tau = np.arange(-5 * sigma, 5 * sigma, dt)
+        filt = np.exp(-0.5 * (tau / sigma) ** 2)
+        filt /= filt.sum()
+        size = int(np.round(filt.size / 2))
+        return np.convolve(filt, bspk, mode='full')[size:size + time.size] / dt
+    assert np.allclose(fr, expected(sigma))
+
+    # narrow filters of both odd and even sizes
+    for sigma in (0.001, 0.0012, 0.0031, 0.005):
+        assert np.allclose(spk.estfr(bspk, time, sigma=sigma), expected(sigma))
+
+    # rates of a sparse spike train are exactly zero away from the spikes
+    time = np.arange(0, 200, dt)
+    bspk = np.zeros(time.size)
+    bspk[[50000, 150000]] = 1
+    fr = spk.estfr(bspk, time, sigma=0.1)
+    assert np.all(fr >= 0)
+    assert np.array_equal(fr == 0, expected(0.1) == 0)
+
+    # negative inputs give negative rates, which are kept
+    bspk[150000] = -1
+    fr = spk.estfr(bspk, time, sigma=0.1)
+    assert np.allclose(fr, expected(0.1))
+    assert fr.min() < 0
+    assert np.array_equal(fr == 0, expected(0.1) == 0)
+
+
+def test_psth():
+
+    # fused binning and smoothing should match binspikes + estfr
+    np.random.seed(0)
+    spike_times = np.random.uniform(0, 10, size=1000)
+    time = np.arange(0, 10, 0.01)
+    bspk, psth = spk._psth(spike_times, time, sigma=0.01)
+    assert np.array_equal(bspk, spk.binspikes(spike_times, time))
+    assert np.allclose(psth, spk.estfr(bspk, time, sigma=0.01), rtol=1e-4, atol=1e-2)
+
+
 def test_spiking_events():
     np.random.seed(1234)
 
@@ -80,6 +171,75 @@ def test_spiking_events():
     sorted_spks = sorted_spks[np.argsort(sorted_spks[:, 1]), 0]
     assert np.all(np.diff(sorted_spks) > 0)
 
+    # events at the very start of the recording are detected
+    spikes = []
+    for trial_index in range(T):
+        s = spiketimes - 0.1 + jitter * np.random.rand(N,)
+        spikes.append(np.stack((s, trial_index * np.ones(N,))))
+    spikes = np.hstack(spikes).T
+    t, psth, bspk, events = spk.detectevents(spikes)
+    assert len(events) == N
+    assert events[0].start == 0
+    assert events[0].times.size == T
+
+    # no (empty) event is made of spikes in the last bin of the recording
+    spikes = np.vstack([np.array([[0.5, trial_index], [1.995, trial_index]])
+                        for trial_index in range(20)])
+    t, psth, bspk, events = spk.detectevents(spikes)
+    assert len(events) == 1
+    assert events[0].times.size == 20
+
+
+def test_spiking_event_storage():
+
+    spikes = np.array([[0.3, 2], [0.1, 5], [0.2, 2], [0.4, 5], [0.05, 7]])
+    ev = spk.SpikingEvent(0., 1., spikes)
+    assert ev.times.dtype == np.float64
+    assert np.issubdtype(ev.trials.dtype, np.integer)
+    assert np.array_equal(ev.spikes, spikes)
+
+    # spike times and trials may also be given separately
+    other = spk.SpikingEvent(0., 1., spikes[:, 0], trials=spikes[:, 1])
+    assert np.array_equal(other.spikes, spikes)
+
+    # extra columns are ignored, and empty or single-column input handled
+    extra = np.column_stack((spikes, np.ones(spikes.shape[0])))
+    assert np.array_equal(spk.SpikingEvent(0., 1., extra).spikes, spikes)
+    assert spk.SpikingEvent(0., 1., []).spikes.shape == (0, 2)
+    with pytest.raises(ValueError):
+        spk.SpikingEvent(0., 1., spikes[:, :1])
+
+    # mismatched or non-integer trial indices are rejected
+    with pytest.raises(ValueError):
+        spk.SpikingEvent(0., 1., [0.1, 0.2, 0.3], trials=[1, 2])
+    with pytest.raises(ValueError):
+        spk.SpikingEvent(0., 1., [0.1, 0.2], trials=[1.5, 1.7])
+    with pytest.raises(ValueError):
+        spk.SpikingEvent(0., 1., np.array([[0.1, 1.5], [0.2, 1.7]]))
+
+    # the combined spikes array is read-only, as it is derived from the
+    # stored times and trials
+    with pytest.raises(ValueError):
+        ev.spikes[:, 0] -= 0.1
+
+    # setting the spikes updates the stored times and trials
+    other.spikes = spikes[:2]
+    assert np.array_equal(other.times, spikes[:2, 0])
+    assert np.array_equal(other.trials, spikes[:2, 1])
+
+    # time to first spike does not depend on the order of the spikes
+    assert np.array_equal(ev.ttfs(), [0.2, 0.1, 0.05])
+    assert spk.SpikingEvent(0., 1., np.zeros((0, 2))).ttfs().size == 0
+
+    # trials are relabeled 1..n by their first spike
+    sorted_spks = ev.sort()
+    assert np.array_equal(sorted_spks[:, 0], spikes[:, 0])
+    assert np.array_equal(sorted_spks[:, 1], [3, 2, 3, 2, 1])
+
+    # sorting uses the earliest spike in each trial, not the first stored
+    ev = spk.SpikingEvent(0., 1., np.array([[0.3, 1], [0.2, 2], [0.1, 1]]))
+    assert np.array_equal(ev.sort()[:, 1], [1, 2, 1])
+
 
 def test_peakdet():
 
@@ -24,6 +24,9 @@ def test_resampling_1d():
     assert np.all(stim == stim_us[::resample_factor]), 'Upsampling failed'
     assert np.all(stim == stim_ds), 'Downsampling failed'
 
+    assert np.allclose(time, time_ds), 'Downsampling time failed'
+    assert np.allclose(np.diff(time_us), dt / resample_factor), 'Upsampling time failed'
+
     _, time_us = stimulustools.upsample(stim, resample_factor)
     assert time_us is None
 
@@ -42,6 +45,7 @@ def test_resampling_2d():
 
     assert np.all(stim == stim_us[::resample_factor, ...]), 'Upsampling failed'
     assert np.all(stim == stim_ds), 'Downsampling failed'
+    assert np.shares_memory(stim_ds, stim_us), 'Downsampling copied the stimulus'
 
 def test_slicestim_raises():
     """Verify slicestim() raises correct exceptions"""